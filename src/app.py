@@ -6,11 +6,19 @@
 """
 
 import os
+import sys
 import wave
 import json
 import time
 import threading
 import argparse
+import hmac
+import heapq
+import itertools
+from concurrent.futures import Future, InvalidStateError, wait as wait_futures
+from functools import wraps
+from collections import defaultdict, deque
+import numpy as np
 from flask import Flask, request, jsonify, render_template, send_file
 from werkzeug.utils import secure_filename
 from funasr import AutoModel
@@ -18,8 +26,38 @@ from funasr import AutoModel
 # 配置
 UPLOAD_FOLDER = 'uploads'
 STUDENTS_FILE = 'students.json'
+MODELS_FILE = 'models.json'  # 多模型及路由配置
+WARMUP_FILE = 'asr_example.wav'  # 模型预热音频
 ALLOWED_EXTENSIONS = {'wav'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+ADMIN_TOKEN = os.environ.get('ASR_ADMIN_TOKEN', '')  # 管理接口令牌，为空时禁用管理接口
+PROFILE_MAX_SECONDS = 60  # 单次性能采样最长时间（秒）
+PROFILE_DEFAULT_INTERVAL = 0.01  # 默认采样间隔（秒）
+PROFILE_MAX_MEMORY_ENTRIES = 200  # 内存分析最多返回的调用位置数
+ASR_BACKENDS = ('torch', 'onnx', 'onnx-int8')  # 可选推理后端
+DEFAULT_BACKEND = 'torch'
+# 长音频分段识别配置
+LONG_AUDIO_SECONDS = 30  # 超过该时长的音频在静音处分段识别
+SEGMENT_MAX_SECONDS = 20  # 单段最长时长
+SEGMENT_MIN_SECONDS = 5  # 单段最短时长（避免切出过短的片段）
+SEGMENT_BATCH_SIZE = 4  # 分段批量识别的批大小
+SILENT_RMS_THRESHOLD = 100  # 低于该均方根音量的录音视为静音（麦克风可能故障）
+# 识别任务调度配置：priority 越小越优先，max_queue 为排队上限，deadline 为最长等待时间（秒，None 表示不过期）
+SCHEDULER_CLASSES = {
+    'live': {'priority': 0, 'max_queue': 32, 'deadline': 30},  # 设备实时上传
+    'manual': {'priority': 1, 'max_queue': 64, 'deadline': None},  # 运行期间手动放入文件夹的文件
+    'backfill': {'priority': 2, 'max_queue': 8, 'deadline': None}  # 启动前遗留或批量复制的文件
+}
+ASR_WORKERS = 2  # 同时进行识别的任务数
+MANUAL_BURST_LIMIT = 5  # 单次扫描中超过该数量的新文件按补识别(backfill)处理
+# ONNX Runtime 线程配置
+ONNX_INTRA_OP_THREADS = 4
+ONNX_INTER_OP_THREADS = 1
+# funasr-onnx 不识别 AutoModel 的简称，需要映射到 modelscope 模型ID
+# 与 FunASR 自身的映射（funasr/download/name_maps_from_hub.py）保持一致，保证各后端运行的是同一个模型
+ONNX_MODEL_ALIASES = {
+    'paraformer-zh': 'iic/speech_seaco_paraformer_large_asr_nat-zh-cn-16k-common-vocab8404-pytorch'
+}
 
 # 创建应用
 app = Flask(__name__)
@@ -30,10 +68,11 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # 全局变量
-model = None
 students = []
 recognized_messages = []
 recognized_messages_lock = threading.Lock()
+device_stats = {}  # 设备ID -> 上传和识别统计
+device_stats_lock = threading.Lock()
 
 # 加载学生列表
 def load_students():
@@ -116,29 +155,621 @@ def load_wav_file(file_path):
         print(f"加载WAV文件失败: {e}")
         return None
 
-def recognize_wav_file(wav_file_path):
+class OnnxParaformerModel:
+    """
+    基于 funasr-onnx 的 Paraformer 推理后端
+    提供与 AutoModel 相同的 generate 接口，输入16kHz 16位PCM字节（或其列表），返回 [{'text': ...}, ...]
+    """
+    
+    def __init__(self, model_name, quantize=True, intra_op_threads=4, inter_op_threads=1):
+        from funasr_onnx import Paraformer, SeacoParaformer
+        model_dir = ONNX_MODEL_ALIASES.get(model_name, model_name)
+        # SeACo-Paraformer（paraformer-zh）带热词编码器，需要单独的模型类
+        self.seaco = 'seaco' in os.path.basename(os.path.normpath(model_dir)).lower()
+        model_class = SeacoParaformer if self.seaco else Paraformer
+        self.model = model_class(model_dir, batch_size=1, quantize=quantize, intra_op_num_threads=intra_op_threads)
+        
+        if self.seaco:
+            # 不使用热词时只保留 <s> 占位，与 AutoModel 无热词时的偏置输入一致
+            proc_hotword = self.model.proc_hotword
+            self.model.proc_hotword = lambda hotwords: proc_hotword(hotwords) if hotwords else (
+                np.array([[1] + [0] * 9]), np.array([0]))
+        
+        # funasr-onnx 只开放了 intra_op 线程数，需要时按相同模型文件重建会话以设置 inter_op 线程数
+        if inter_op_threads > 1:
+            import onnxruntime
+            for attr in ('ort_infer', 'ort_infer_bb', 'ort_infer_eb'):
+                infer = getattr(self.model, attr, None)
+                model_path = getattr(infer.session, '_model_path', None) if infer is not None else None
+                if not model_path:
+                    continue
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = intra_op_threads
+                options.inter_op_num_threads = inter_op_threads
+                options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                options.log_severity_level = 4
+                infer.session = onnxruntime.InferenceSession(
+                    model_path, sess_options=options, providers=['CPUExecutionProvider'])
+    
+    @staticmethod
+    def pcm_to_waveform(audio_data):
+        """16位PCM字节转换为 [-1, 1] 范围的浮点波形"""
+        return np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
+    
+    def generate(self, audio_data, **kwargs):
+        inputs = audio_data if isinstance(audio_data, list) else [audio_data]
+        results = []
+        for item in inputs:
+            # 静音或噪声片段 funasr-onnx 不返回结果，按空文本处理
+            waveform = self.pcm_to_waveform(item)
+            outputs = self.model(waveform, hotwords='') if self.seaco else self.model(waveform)
+            text = outputs[0]['preds'] if outputs else ''
+            if isinstance(text, (list, tuple)):
+                text = text[0]
+            results.append({'text': text})
+        return results
+
+def create_asr_model(model_name, backend='torch'):
+    """按后端创建识别模型"""
+    if backend == 'torch':
+        return AutoModel(model=model_name, disable_update=True)
+    if backend in ('onnx', 'onnx-int8'):
+        return OnnxParaformerModel(
+            model_name,
+            quantize=(backend == 'onnx-int8'),
+            intra_op_threads=ONNX_INTRA_OP_THREADS,
+            inter_op_threads=ONNX_INTER_OP_THREADS
+        )
+    raise ValueError(f'不支持的推理后端: {backend}')
+
+class ModelManager:
+    """
+    识别模型管理器
+    支持后台加载并预热新模型、原子切换默认模型、按学生/设备路由到不同模型，并统计各模型的识别延迟
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models = {}  # 模型别名 -> 已加载模型信息
+        self.loading = {}  # 模型别名 -> 加载状态
+        self.default_name = None
+        self.routes = {'students': {}, 'devices': {}}
+    
+    def mark_loading(self, name):
+        """将模型标记为加载中，该模型已在加载时返回 False"""
+        with self.lock:
+            if self.loading.get(name) == 'loading':
+                return False
+            self.loading[name] = 'loading'
+            return True
+    
+    def load(self, name, model_name, backend=None, make_default=False, warmup=True):
+        """加载并预热模型，完成后原子替换同名模型（正在使用旧模型的请求不受影响）"""
+        if not self.mark_loading(name):
+            raise RuntimeError(f'模型 {name} 正在加载中')
+        return self.load_marked(name, model_name, backend, make_default, warmup)
+    
+    def load_marked(self, name, model_name, backend, make_default, warmup):
+        """加载已标记为加载中的模型"""
+        backend = backend or DEFAULT_BACKEND
+        try:
+            print(f"正在加载模型: {name} ({model_name}, 后端: {backend})")
+            new_model = create_asr_model(model_name, backend)
+            if warmup:
+                self.warmup(new_model)
+        except Exception as e:
+            with self.lock:
+                self.loading[name] = f'failed: {e}'
+            print(f"模型加载失败 {name}: {e}")
+            raise
+        
+        entry = {
+            'model': new_model,
+            'model_name': model_name,
+            'backend': backend,
+            'loaded_at': time.time(),
+            'stats': {
+                'count': 0,
+                'failures': 0,
+                'total_latency': 0.0,
+                'total_audio_seconds': 0.0,
+                'recent_latencies': deque(maxlen=200)
+            }
+        }
+        with self.lock:
+            self.models[name] = entry
+            self.loading.pop(name, None)
+            if make_default or self.default_name is None:
+                self.default_name = name
+        print(f"模型加载完成: {name}")
+        return entry
+    
+    def load_async(self, name, model_name, backend=None, make_default=False, warmup=True):
+        """在后台线程中加载模型，不阻塞请求处理；该模型已在加载时返回 None"""
+        if not self.mark_loading(name):
+            return None
+        
+        def run():
+            try:
+                self.load_marked(name, model_name, backend, make_default, warmup)
+                self.save_config()
+            except Exception:
+                # 失败原因已记录在 loading 状态中，可通过模型列表接口查看
+                pass
+        thread = threading.Thread(target=run, name=f'model-loader-{name}', daemon=True)
+        thread.start()
+        return thread
+    
+    def warmup(self, asr_model):
+        """用示例音频（不存在时使用1秒静音）跑一次推理，避免首个请求承担初始化开销"""
+        audio_data = load_wav_file(WARMUP_FILE) if os.path.exists(WARMUP_FILE) else None
+        if audio_data is None:
+            audio_data = b'\x00\x00' * 16000
+        start = time.time()
+        asr_model.generate(audio_data)
+        print(f"模型预热完成，耗时{time.time() - start:.2f}秒")
+    
+    def unload(self, name):
+        """卸载模型，默认模型不可卸载"""
+        with self.lock:
+            if name not in self.models:
+                raise KeyError(name)
+            if name == self.default_name:
+                raise ValueError('不能卸载默认模型')
+            del self.models[name]
+            # 清理指向该模型的路由
+            for table in self.routes.values():
+                for key in [k for k, v in table.items() if v == name]:
+                    del table[key]
+    
+    def set_default(self, name):
+        """切换默认模型"""
+        with self.lock:
+            if name not in self.models:
+                raise KeyError(name)
+            self.default_name = name
+    
+    def set_route(self, route_type, key, name):
+        """
+        设置路由：route_type 为 students 或 devices
+        设备路由的 key 以 * 结尾时按前缀匹配一组设备；name 为空时删除该路由
+        """
+        with self.lock:
+            table = self.routes[route_type]
+            if not name:
+                table.pop(key, None)
+                return
+            if name not in self.models:
+                raise KeyError(name)
+            table[key] = name
+    
+    def resolve(self, student_name=None, device_id=None):
+        """按 设备精确匹配 > 设备前缀匹配 > 学生 > 默认模型 的顺序选择模型，返回 (别名, 模型)"""
+        with self.lock:
+            name = None
+            if device_id:
+                devices = self.routes['devices']
+                name = devices.get(device_id)
+                if name is None:
+                    prefixes = [k for k in devices if k.endswith('*') and device_id.startswith(k[:-1])]
+                    if prefixes:
+                        name = devices[max(prefixes, key=len)]
+            if name is None and student_name:
+                name = self.routes['students'].get(student_name)
+            if name not in self.models:
+                name = self.default_name
+            if name is None:
+                return None, None
+            return name, self.models[name]['model']
+    
+    def record(self, name, latency, audio_seconds, success):
+        """记录一次识别的延迟统计"""
+        with self.lock:
+            entry = self.models.get(name)
+            if entry is None:
+                return
+            stats = entry['stats']
+            if not success:
+                stats['failures'] += 1
+                return
+            stats['count'] += 1
+            stats['total_latency'] += latency
+            stats['total_audio_seconds'] += audio_seconds
+            stats['recent_latencies'].append(latency)
+    
+    def describe(self):
+        """返回模型、路由和延迟统计信息"""
+        with self.lock:
+            models = []
+            for name, entry in self.models.items():
+                stats = entry['stats']
+                recent = sorted(stats['recent_latencies'])
+                count = stats['count']
+                models.append({
+                    'name': name,
+                    'model': entry['model_name'],
+                    'backend': entry['backend'],
+                    'default': name == self.default_name,
+                    'loaded_at': entry['loaded_at'],
+                    'count': count,
+                    'failures': stats['failures'],
+                    'avg_latency': stats['total_latency'] / count if count else None,
+                    'p50_latency': recent[len(recent) // 2] if recent else None,
+                    'p95_latency': recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else None,
+                    'rtf': stats['total_latency'] / stats['total_audio_seconds'] if stats['total_audio_seconds'] else None
+                })
+            return {
+                'default': self.default_name,
+                'models': models,
+                'loading': dict(self.loading),
+                'routes': {k: dict(v) for k, v in self.routes.items()}
+            }
+    
+    def save_config(self):
+        """保存模型列表、默认模型和路由，重启后自动恢复"""
+        with self.lock:
+            config = {
+                'default': self.default_name,
+                'models': {
+                    name: {'model': entry['model_name'], 'backend': entry['backend']}
+                    for name, entry in self.models.items()
+                },
+                'routes': {k: dict(v) for k, v in self.routes.items()}
+            }
+        try:
+            with open(MODELS_FILE, 'w', encoding='utf-8') as f:
+                json.dump(config, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存模型配置失败: {e}")
+    
+    def restore_config(self):
+        """启动时恢复路由，并在后台加载配置中的其他模型"""
+        if not os.path.exists(MODELS_FILE):
+            return
+        try:
+            with open(MODELS_FILE, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except Exception as e:
+            print(f"加载模型配置失败: {e}")
+            return
+        
+        with self.lock:
+            for route_type in self.routes:
+                self.routes[route_type].update(config.get('routes', {}).get(route_type, {}))
+        for name, spec in config.get('models', {}).items():
+            if name not in self.models:
+                self.load_async(name, spec['model'], backend=spec.get('backend'),
+                                make_default=(name == config.get('default')))
+
+model_manager = ModelManager()
+
+def split_at_silence(audio_data, sample_rate=16000):
+    """
+    将长音频在静音处切分为不超过 SEGMENT_MAX_SECONDS 的片段
+    返回 [(起始采样点, 结束采样点), ...]，短音频直接返回整段
+    """
+    samples = np.frombuffer(audio_data, dtype=np.int16)
+    total = len(samples)
+    if total <= LONG_AUDIO_SECONDS * sample_rate:
+        return [(0, total)]
+    
+    # 计算30ms帧能量，并在约300ms窗口上平滑，使切点落在较长的停顿中
+    frame = sample_rate * 30 // 1000
+    frame_count = total // frame
+    frames = samples[:frame_count * frame].astype(np.float32).reshape(frame_count, frame)
+    energy = np.sqrt(np.mean(frames ** 2, axis=1))
+    energy = np.convolve(energy, np.ones(10) / 10, mode='same')
+    
+    max_len = SEGMENT_MAX_SECONDS * sample_rate
+    min_len = SEGMENT_MIN_SECONDS * sample_rate
+    segments = []
+    start = 0
+    while total - start > max_len:
+        # 在 [start+最短, start+最长] 内找能量最低的帧作为切点，同时保证剩余部分不短于最短时长；
+        # 能量接近最低的帧（如连续静音或平稳噪声）取最靠后的一个，使分段尽量长、段数尽量少
+        low = (start + min_len) // frame
+        high = min(start + max_len, total - min_len) // frame
+        window = energy[low:high]
+        candidates = np.flatnonzero(window <= window.min() * 1.05 + 1.0)
+        cut = (low + int(candidates[-1])) * frame + frame // 2
+        segments.append((start, cut))
+        start = cut
+    segments.append((start, total))
+    return segments
+
+def decode_audio_batch(asr_model, audio_list, batch_size=SEGMENT_BATCH_SIZE):
+    """
+    批量识别多条音频：长音频先在静音处切分，所有片段按长度排序后合并为批次输入模型以减少填充
+    返回与 audio_list 对应的 segments 列表，每项为 [{'start', 'end', 'text'}, ...]
+    """
+    bounds_list = [split_at_silence(audio_data) for audio_data in audio_list]
+    pieces = []
+    for audio_data, bounds in zip(audio_list, bounds_list):
+        for begin, end in bounds:
+            pieces.append(audio_data[begin * 2:end * 2])
+    
+    if len(pieces) == 1:
+        texts = [asr_model.generate(pieces[0])[0]['text']]
+    else:
+        order = sorted(range(len(pieces)), key=lambda i: len(pieces[i]))
+        results = asr_model.generate([pieces[i] for i in order], batch_size=batch_size)
+        texts = [None] * len(pieces)
+        for i, r in zip(order, results):
+            texts[i] = r['text']
+    
+    segments_list = []
+    index = 0
+    for bounds in bounds_list:
+        segments = []
+        for begin, end in bounds:
+            segments.append({
+                'start': round(begin / 16000, 2),
+                'end': round(end / 16000, 2),
+                'text': texts[index].replace(" ", "")
+            })
+            index += 1
+        segments_list.append(segments)
+    return segments_list
+
+def transcribe_wav_file(wav_file_path, student_name=None, device_id=None):
     """
     使用FunASR模型识别WAV文件中的语音
+    长音频在静音处分段后批量识别，再按时间顺序拼接
+    返回 {'text': 全文, 'segments': [{'start', 'end', 'text'}, ...], 'model': 模型别名,
+          'duration': 时长（秒）, 'rms': 均方根音量}，失败时返回 None
     """
-    global model
     try:
         # 加载WAV文件
         audio_data = load_wav_file(wav_file_path)
         if audio_data is None:
             return None
-            
-        print(f"正在处理文件: {wav_file_path}")
         
-        # 使用模型进行识别
-        result = model.generate(audio_data)
-        text = result[0]['text'].replace(" ", "")
+        model_name, asr_model = model_manager.resolve(student_name, device_id)
+        if asr_model is None:
+            print("模型尚未加载")
+            return None
+        
+        print(f"正在处理文件: {wav_file_path} (模型: {model_name})")
+        
+        # 使用模型进行识别，多段时作为一个批次输入
+        start = time.time()
+        try:
+            segments = decode_audio_batch(asr_model, [audio_data])[0]
+        except Exception:
+            model_manager.record(model_name, 0, 0, False)
+            raise
+        model_manager.record(model_name, time.time() - start, len(audio_data) / 32000, True)
+        
+        text = ''.join(segment['text'] for segment in segments)
         print(f"识别结果: {text}")
-        return text
+        samples = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32)
+        return {
+            'text': text,
+            'segments': segments,
+            'model': model_name,
+            'duration': len(audio_data) / 32000,
+            'rms': float(np.sqrt(np.mean(samples ** 2))) if len(samples) else 0.0
+        }
         
     except Exception as e:
         print(f"语音识别错误: {e}")
         return None
 
+def record_device_upload(device_id, student_name, size=0, result=None, latency=0.0, failed=False, rejected=False):
+    """
+    更新设备上传统计，每次上传 O(1)
+    rejected 表示录音已保存但因服务器繁忙未能实时识别，单独计数，不计入设备的失败率
+    """
+    now = time.time()
+    with device_stats_lock:
+        stats = device_stats.get(device_id)
+        if stats is None:
+            stats = device_stats[device_id] = {
+                'device_id': device_id,
+                'student': student_name,
+                'first_seen': now,
+                'last_seen': now,
+                'upload_count': 0,
+                'bytes': 0,
+                'failure_count': 0,
+                'rejected_count': 0,
+                'recognized_count': 0,
+                'silent_count': 0,
+                'total_audio_seconds': 0.0,
+                'total_latency': 0.0,
+                'total_rms': 0.0,
+                'last_error_at': None
+            }
+        stats['student'] = student_name
+        stats['last_seen'] = now
+        stats['upload_count'] += 1
+        stats['bytes'] += size
+        if rejected:
+            stats['rejected_count'] += 1
+            return
+        if failed or result is None:
+            stats['failure_count'] += 1
+            stats['last_error_at'] = now
+            return
+        stats['recognized_count'] += 1
+        stats['total_audio_seconds'] += result['duration']
+        stats['total_latency'] += latency
+        stats['total_rms'] += result['rms']
+        if not result['text'] or result['rms'] < SILENT_RMS_THRESHOLD:
+            stats['silent_count'] += 1
+
+def get_device_stats():
+    """返回所有设备的统计汇总，按最近上传时间倒序"""
+    with device_stats_lock:
+        snapshot = [dict(stats) for stats in device_stats.values()]
+    
+    devices = []
+    for stats in snapshot:
+        recognized = stats.pop('recognized_count')
+        total_audio = stats.pop('total_audio_seconds')
+        total_latency = stats.pop('total_latency')
+        total_rms = stats.pop('total_rms')
+        stats['recognized_count'] = recognized
+        stats['avg_clip_seconds'] = total_audio / recognized if recognized else None
+        stats['avg_latency'] = total_latency / recognized if recognized else None
+        stats['avg_rms'] = total_rms / recognized if recognized else None
+        stats['silent_ratio'] = stats['silent_count'] / recognized if recognized else None
+        attempted = stats['upload_count'] - stats['rejected_count']
+        stats['failure_ratio'] = stats['failure_count'] / attempted if attempted else None
+        devices.append(stats)
+    devices.sort(key=lambda d: d['last_seen'], reverse=True)
+    return devices
+
+def recognize_wav_file(wav_file_path, student_name=None, device_id=None):
+    """
+    使用FunASR模型识别WAV文件中的语音
+    根据学生姓名或设备ID路由到对应的模型
+    """
+    result = transcribe_wav_file(wav_file_path, student_name=student_name, device_id=device_id)
+    return result['text'] if result is not None else None
+
+class RecognitionScheduler:
+    """
+    识别任务优先级调度器
+    按 live > manual > backfill 的优先级出队，每类任务有独立的排队上限；
+    超过截止时间的任务在出队时直接丢弃，同时执行的任务数由工作线程数限制
+    """
+    
+    def __init__(self, classes):
+        self.classes = classes
+        self.condition = threading.Condition()
+        self.heap = []
+        self.sequence = itertools.count()
+        self.queued = {name: 0 for name in classes}
+        self.stats = {
+            name: {'submitted': 0, 'started': 0, 'completed': 0, 'rejected': 0, 'dropped': 0, 'total_wait': 0.0}
+            for name in classes
+        }
+        self.in_flight = 0
+        self.workers = []
+        self.running = False
+    
+    def start(self, worker_count):
+        """启动识别工作线程"""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.workers = [
+            threading.Thread(target=self.worker, name=f'asr-worker-{i}', daemon=True)
+            for i in range(worker_count)
+        ]
+        for worker in self.workers:
+            worker.start()
+        print(f"识别调度器已启动: {worker_count}个工作线程")
+    
+    def stop(self):
+        """停止工作线程，取消仍在排队的任务"""
+        with self.condition:
+            self.running = False
+            pending = [item[5] for item in self.heap]
+            self.heap.clear()
+            self.queued = {name: 0 for name in self.classes}
+            self.condition.notify_all()
+        for future in pending:
+            future.cancel()
+        for worker in self.workers:
+            worker.join(timeout=5)
+    
+    def submit(self, job_class, func, *args, count_rejection=True, **kwargs):
+        """
+        提交识别任务，返回 Future；该类队列已满时返回 None
+        重复提交此前已被拒绝的任务时传入 count_rejection=False，避免重复计入拒绝数
+        """
+        config = self.classes[job_class]
+        now = time.time()
+        deadline = now + config['deadline'] if config['deadline'] else None
+        with self.condition:
+            if self.queued[job_class] >= config['max_queue']:
+                if count_rejection:
+                    self.stats[job_class]['rejected'] += 1
+                return None
+            future = Future()
+            heapq.heappush(self.heap, (config['priority'], next(self.sequence), job_class, now, deadline,
+                                       future, func, args, kwargs))
+            self.queued[job_class] += 1
+            self.stats[job_class]['submitted'] += 1
+            self.condition.notify()
+        return future
+    
+    def worker(self):
+        """工作线程：取出优先级最高的任务执行，丢弃已过期或已取消的任务"""
+        while True:
+            with self.condition:
+                while self.running and not self.heap:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                _, _, job_class, submitted_at, deadline, future, func, args, kwargs = heapq.heappop(self.heap)
+                self.queued[job_class] -= 1
+                now = time.time()
+                expired = deadline is not None and now > deadline
+                if expired or future.cancelled():
+                    self.stats[job_class]['dropped'] += 1
+                    runnable = False
+                else:
+                    self.stats[job_class]['started'] += 1
+                    self.stats[job_class]['total_wait'] += now - submitted_at
+                    self.in_flight += 1
+                    runnable = True
+            
+            if not runnable:
+                if expired:
+                    # 提交方可能同时取消了该任务，此时 Future 已处于完成状态
+                    try:
+                        future.set_exception(TimeoutError('识别任务等待超时，已丢弃'))
+                    except InvalidStateError:
+                        pass
+                continue
+            if not future.set_running_or_notify_cancel():
+                with self.condition:
+                    self.in_flight -= 1
+                    self.stats[job_class]['started'] -= 1
+                    self.stats[job_class]['dropped'] += 1
+                continue
+            
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self.condition:
+                    self.in_flight -= 1
+                    self.stats[job_class]['completed'] += 1
+    
+    def describe(self):
+        """返回各类任务的排队和执行统计"""
+        with self.condition:
+            classes = {}
+            for name, config in self.classes.items():
+                stats = self.stats[name]
+                started = stats['started']
+                classes[name] = {
+                    'priority': config['priority'],
+                    'max_queue': config['max_queue'],
+                    'deadline': config['deadline'],
+                    'queued': self.queued[name],
+                    'submitted': stats['submitted'],
+                    'completed': stats['completed'],
+                    'rejected': stats['rejected'],
+                    'dropped': stats['dropped'],
+                    'avg_wait': stats['total_wait'] / started if started else None
+                }
+            return {
+                'running': self.running,
+                'workers': len(self.workers),
+                'in_flight': self.in_flight,
+                'classes': classes
+            }
+
+scheduler = RecognitionScheduler(SCHEDULER_CLASSES)
+
 @app.route('/')
 def index():
     """主页 - 使用模板"""
@@ -251,6 +882,11 @@ def update_student_color(student_name):
     except Exception as e:
         return jsonify({'error': f'更新失败: {str(e)}'}), 500
 
+@app.route('/api/devices', methods=['GET'])
+def get_devices():
+    """获取设备上传健康统计"""
+    return jsonify({'devices': get_device_stats()})
+
 @app.route('/api/messages', methods=['GET'])
 def get_messages():
     """获取识别消息列表"""
@@ -404,6 +1040,9 @@ def import_students_from_excel():
 @app.route('/upload', methods=['POST'])
 def upload_from_esp32():
     """处理ESP32设备上传的录音文件"""
+    global recognized_messages
+    device_id = ''
+    student_name = ''
     try:
         # 从请求头获取设备ID
         device_id = request.headers.get('Device-Id', '').strip()
@@ -448,10 +1087,12 @@ def upload_from_esp32():
         
         # 处理文件上传
         if 'file' not in request.files:
+            record_device_upload(device_id, student_name, failed=True)
             return jsonify({'error': '未提供文件'}), 400
         
         file = request.files['file']
         if file.filename == '':
+            record_device_upload(device_id, student_name, failed=True)
             return jsonify({'error': '文件名为空'}), 400
         
         if file and allowed_file(file.filename):
@@ -461,10 +1102,35 @@ def upload_from_esp32():
             filename = f"esp32_{device_id}_{timestamp}.wav"
             
             filepath = os.path.join(student_folder, filename)
+            # 先登记为处理中，避免监控线程重复识别
+            pending_files.add(filepath)
             file.save(filepath)
             
-            # 立即进行语音识别
-            result_text = recognize_wav_file(filepath)
+            # 以最高优先级提交语音识别，并等待结果
+            start = time.time()
+            future = scheduler.submit('live', transcribe_wav_file, filepath,
+                                      student_name=student_name, device_id=device_id)
+            if future is None:
+                # 队列已满，文件保留由监控线程稍后补识别
+                pending_files.discard(filepath)
+                record_device_upload(device_id, student_name, os.path.getsize(filepath), rejected=True)
+                return jsonify({'error': '识别队列已满，录音已保存，稍后自动识别', 'filename': filename}), 503
+            # 截止时间只限制排队等待：到期仍未开始则取消，已开始的任务等待其识别完成
+            wait_futures([future], timeout=SCHEDULER_CLASSES['live']['deadline'])
+            future.cancel()
+            try:
+                result = future.result()
+            except Exception as e:
+                # 排队超时被取消或丢弃，任务已结束，文件保留由监控线程稍后补识别
+                pending_files.discard(filepath)
+                record_device_upload(device_id, student_name, os.path.getsize(filepath), rejected=True)
+                print(f"实时识别未完成 {filepath}: {e!r}")
+                return jsonify({'error': '识别排队超时，录音已保存，稍后自动识别', 'filename': filename}), 503
+            
+            processed_files.add(filepath)
+            pending_files.discard(filepath)
+            record_device_upload(device_id, student_name, os.path.getsize(filepath), result, time.time() - start)
+            result_text = result['text'] if result is not None else None
             if result_text is not None:
                 with recognized_messages_lock:
                     recognized_messages.append({
@@ -484,13 +1150,17 @@ def upload_from_esp32():
                 'student': student_name,
                 'filename': filename,
                 'recognized_text': result_text,
+                'segments': result['segments'] if result is not None else [],
                 'device_id': device_id
             })
         else:
+            record_device_upload(device_id, student_name, failed=True)
             return jsonify({'error': '不支持的文件格式'}), 400
             
     except Exception as e:
         print(f"ESP32上传处理错误: {e}")
+        if device_id:
+            record_device_upload(device_id, student_name, failed=True)
         return jsonify({'error': f'上传失败: {str(e)}'}), 500
 
 @app.route('/api/students/<student_name>/device', methods=['PUT'])
@@ -651,17 +1321,642 @@ def clear_all_students():
     except Exception as e:
         return jsonify({'error': f'清空失败: {str(e)}'}), 500
 
-def init_model(model_name="paraformer-zh"):
-    """初始化FunASR模型"""
-    global model
-    print(f"正在加载模型: {model_name}")
-    model = AutoModel(model=model_name, disable_update=True)
-    print("模型加载完成")
+def admin_required(view):
+    """管理接口装饰器，要求请求头 Admin-Token 与配置的令牌一致"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': '管理接口未启用，请通过 --admin-token 或 ASR_ADMIN_TOKEN 配置令牌'}), 403
+        if not hmac.compare_digest(request.headers.get('Admin-Token', '').encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return jsonify({'error': '管理令牌无效'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+# 性能采样锁，同一时间只允许一个采样任务
+profile_lock = threading.Lock()
+
+def sample_thread_stacks(duration, interval):
+    """
+    对所有线程进行定时栈采样
+    返回 ({(线程名, (栈帧, ...)): 采样次数}, 采样轮数)，栈帧按调用顺序由外到内排列
+    """
+    stack_counts = defaultdict(int)
+    own_ident = threading.get_ident()
+    rounds = 0
+    end_time = time.time() + duration
+    
+    while time.time() < end_time:
+        thread_names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()
+            stack_counts[(thread_names.get(ident, str(ident)), tuple(stack))] += 1
+        rounds += 1
+        time.sleep(interval)
+    
+    return stack_counts, rounds
+
+def format_collapsed_stacks(stack_counts):
+    """转换为 flamegraph.pl / speedscope 可读的折叠栈格式"""
+    lines = []
+    for (thread_name, stack), count in stack_counts.items():
+        frames = [thread_name.replace(';', ':')]
+        for name, filename, lineno in stack:
+            frames.append(f"{name} ({os.path.basename(filename)}:{lineno})".replace(';', ':'))
+        lines.append(f"{';'.join(frames)} {count}")
+    lines.sort()
+    return '\n'.join(lines) + '\n'
+
+def format_speedscope(stack_counts, duration, interval):
+    """转换为 speedscope 的 JSON 文件格式，每个线程一个 profile"""
+    frames = []
+    frame_index = {}
+    per_thread = defaultdict(lambda: {'samples': [], 'weights': []})
+    
+    for (thread_name, stack), count in stack_counts.items():
+        indexes = []
+        for name, filename, lineno in stack:
+            key = (name, filename, lineno)
+            if key not in frame_index:
+                frame_index[key] = len(frames)
+                frames.append({'name': name, 'file': filename, 'line': lineno})
+            indexes.append(frame_index[key])
+        per_thread[thread_name]['samples'].append(indexes)
+        per_thread[thread_name]['weights'].append(round(count * interval, 6))
+    
+    profiles = []
+    for thread_name, data in sorted(per_thread.items()):
+        profiles.append({
+            'type': 'sampled',
+            'name': thread_name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': duration,
+            'samples': data['samples'],
+            'weights': data['weights']
+        })
+    
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': f'studentsASR {time.strftime("%Y-%m-%d %H:%M:%S")}',
+        'exporter': 'studentsASR',
+        'shared': {'frames': frames},
+        'profiles': profiles
+    }
+
+def parse_profile_args():
+    """解析采样时长和采样间隔参数"""
+    seconds = float(request.args.get('seconds', 10))
+    interval = float(request.args.get('interval', PROFILE_DEFAULT_INTERVAL))
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise ValueError(f'seconds 必须在 0 到 {PROFILE_MAX_SECONDS} 之间')
+    if not 0.001 <= interval <= 1:
+        raise ValueError('interval 必须在 0.001 到 1 之间')
+    return seconds, interval
+
+@app.route('/api/admin/profile', methods=['GET'])
+@admin_required
+def profile_server():
+    """对运行中的服务进行限时栈采样，返回折叠栈或 speedscope JSON"""
+    try:
+        seconds, interval = parse_profile_args()
+    except ValueError as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+    
+    output_format = request.args.get('format', 'collapsed')
+    if output_format not in ('collapsed', 'speedscope'):
+        return jsonify({'error': 'format 只支持 collapsed 或 speedscope'}), 400
+    
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({'error': '已有采样任务正在进行'}), 409
+    try:
+        print(f"开始性能采样: {seconds}秒, 间隔{interval}秒")
+        stack_counts, rounds = sample_thread_stacks(seconds, interval)
+        print(f"性能采样完成: 共{rounds}轮")
+    finally:
+        profile_lock.release()
+    
+    timestamp = time.strftime('%Y%m%d_%H%M%S')
+    if output_format == 'speedscope':
+        content = json.dumps(format_speedscope(stack_counts, seconds, interval), ensure_ascii=False)
+        mimetype = 'application/json'
+        download_name = f'profile_{timestamp}.speedscope.json'
+    else:
+        content = format_collapsed_stacks(stack_counts)
+        mimetype = 'text/plain'
+        download_name = f'profile_{timestamp}.collapsed.txt'
+    
+    import io
+    return send_file(
+        io.BytesIO(content.encode('utf-8')),
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=download_name
+    )
+
+@app.route('/api/admin/memory', methods=['GET'])
+@admin_required
+def profile_memory():
+    """使用 tracemalloc 对比一段时间前后的内存分配快照，定位内存增长"""
+    import tracemalloc
+    try:
+        seconds, _ = parse_profile_args()
+        limit = int(request.args.get('limit', 30))
+        if not 1 <= limit <= PROFILE_MAX_MEMORY_ENTRIES:
+            raise ValueError(f'limit 必须在 1 到 {PROFILE_MAX_MEMORY_ENTRIES} 之间')
+    except ValueError as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+    
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({'error': '已有采样任务正在进行'}), 409
+    try:
+        # 若 tracemalloc 由本接口启动，则结束后关闭以免长期占用开销
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(25)
+        try:
+            before = tracemalloc.take_snapshot()
+            time.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+    finally:
+        profile_lock.release()
+    
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'traceback')
+    top = []
+    for stat in stats[:limit]:
+        top.append({
+            'size_diff': stat.size_diff,
+            'size': stat.size,
+            'count_diff': stat.count_diff,
+            'count': stat.count,
+            'traceback': stat.traceback.format()
+        })
+    
+    result = {
+        'seconds': seconds,
+        'traced_since_startup': not started_here,
+        'traced_current': current,
+        'traced_peak': peak,
+        'top_allocations': top
+    }
+    
+    # 启动时已开启跟踪（--tracemalloc）则额外返回当前仍占用内存最多的位置
+    if not started_here:
+        result['top_current'] = [
+            {'size': stat.size, 'count': stat.count, 'traceback': stat.traceback.format()}
+            for stat in after.filter_traces(filters).statistics('lineno')[:limit]
+        ]
+    
+    return jsonify(result)
+
+@app.route('/api/admin/models', methods=['GET'])
+@admin_required
+def get_models():
+    """获取已加载模型、路由和各模型延迟统计"""
+    return jsonify(model_manager.describe())
+
+@app.route('/api/admin/models', methods=['POST'])
+@admin_required
+def load_model():
+    """后台加载（或替换同名）模型，预热完成后自动切换"""
+    try:
+        data = request.get_json()
+        name = data.get('name', '').strip()
+        model_name = data.get('model', '').strip()
+        backend = data.get('backend', DEFAULT_BACKEND)
+        make_default = bool(data.get('default', False))
+        
+        if not name or not model_name:
+            return jsonify({'error': '模型别名和模型名称不能为空'}), 400
+        
+        if backend not in ASR_BACKENDS:
+            return jsonify({'error': f'推理后端只支持: {", ".join(ASR_BACKENDS)}'}), 400
+        
+        if model_manager.load_async(name, model_name, backend=backend, make_default=make_default) is None:
+            return jsonify({'error': '该模型正在加载中'}), 409
+        return jsonify({'success': True, 'message': f'模型{name}开始后台加载'}), 202
+    except Exception as e:
+        return jsonify({'error': f'加载失败: {str(e)}'}), 500
+
+@app.route('/api/admin/models/<name>', methods=['DELETE'])
+@admin_required
+def unload_model(name):
+    """卸载模型"""
+    try:
+        model_manager.unload(name)
+        model_manager.save_config()
+        return jsonify({'success': True, 'message': '模型卸载成功'})
+    except KeyError:
+        return jsonify({'error': '模型不存在'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/admin/models/default', methods=['PUT'])
+@admin_required
+def set_default_model():
+    """切换默认模型"""
+    try:
+        data = request.get_json()
+        model_manager.set_default(data.get('name', '').strip())
+        model_manager.save_config()
+        return jsonify({'success': True, 'message': '默认模型切换成功'})
+    except KeyError:
+        return jsonify({'error': '模型不存在'}), 404
+    except Exception as e:
+        return jsonify({'error': f'切换失败: {str(e)}'}), 500
+
+@app.route('/api/admin/models/routes', methods=['PUT'])
+@admin_required
+def set_model_route():
+    """设置学生或设备到模型的路由，model 为空时删除路由"""
+    try:
+        data = request.get_json()
+        route_type = data.get('type', '')
+        key = data.get('key', '').strip()
+        name = data.get('model', '').strip()
+        
+        if route_type not in ('students', 'devices'):
+            return jsonify({'error': 'type 只支持 students 或 devices'}), 400
+        if not key:
+            return jsonify({'error': '路由键不能为空'}), 400
+        
+        model_manager.set_route(route_type, key, name)
+        model_manager.save_config()
+        return jsonify({'success': True, 'message': '路由更新成功'})
+    except KeyError:
+        return jsonify({'error': '模型不存在'}), 404
+    except Exception as e:
+        return jsonify({'error': f'更新失败: {str(e)}'}), 500
+
+@app.route('/api/admin/scheduler', methods=['GET'])
+@admin_required
+def get_scheduler_stats():
+    """获取识别调度器的排队和执行统计"""
+    return jsonify(scheduler.describe())
+
+def init_model(model_name="paraformer-zh", backend=None):
+    """初始化默认FunASR模型，并恢复已保存的其他模型和路由"""
+    model_manager.load('default', model_name, backend=backend, make_default=True)
+    model_manager.restore_config()
+
+def normalize_transcript(text):
+    """去除空白和标点，用于计算字错误率"""
+    import unicodedata
+    return ''.join(c for c in text if not c.isspace() and not unicodedata.category(c).startswith('P'))
+
+def edit_distance(ref, hyp):
+    """字符级编辑距离"""
+    previous = list(range(len(hyp) + 1))
+    for i, ref_char in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_char in enumerate(hyp, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_char != hyp_char)
+            ))
+        previous = current
+    return previous[-1]
+
+def load_test_set(test_dir):
+    """加载测试集：目录下每个WAV文件需有同名的 .txt 参考文本"""
+    items = []
+    for filename in sorted(os.listdir(test_dir)):
+        if not filename.lower().endswith('.wav'):
+            continue
+        wav_path = os.path.join(test_dir, filename)
+        ref_path = os.path.splitext(wav_path)[0] + '.txt'
+        if not os.path.exists(ref_path):
+            print(f"跳过缺少参考文本的文件: {filename}")
+            continue
+        audio_data = load_wav_file(wav_path)
+        if audio_data is None:
+            continue
+        with open(ref_path, 'r', encoding='utf-8') as f:
+            reference = normalize_transcript(f.read())
+        items.append((filename, audio_data, reference))
+    return items
+
+def benchmark_backend(test_set, model_name, backend, total_audio_seconds, total_ref_chars):
+    """在测试集上评测单个推理后端，返回CER、实时率和延迟统计"""
+    start = time.time()
+    asr_model = create_asr_model(model_name, backend)
+    load_seconds = time.time() - start
+    
+    # 预热一次，避免首次推理的初始化开销计入统计
+    asr_model.generate(test_set[0][1])
+    
+    errors = 0
+    latencies = []
+    details = []
+    for filename, audio_data, reference in test_set:
+        start = time.time()
+        text = asr_model.generate(audio_data)[0]['text']
+        latencies.append(time.time() - start)
+        hypothesis = normalize_transcript(text)
+        file_errors = edit_distance(reference, hypothesis)
+        errors += file_errors
+        details.append({'file': filename, 'reference': reference, 'hypothesis': hypothesis, 'errors': file_errors})
+    
+    latencies.sort()
+    return {
+        'backend': backend,
+        'load_seconds': load_seconds,
+        'cer': errors / total_ref_chars if total_ref_chars else 0.0,
+        'rtf': sum(latencies) / total_audio_seconds,
+        'avg_latency': sum(latencies) / len(latencies),
+        'p95_latency': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        'details': details
+    }
+
+def run_backend_benchmark(test_dir, model_name, backends, output_file=None):
+    """在本地测试集上对比各推理后端的字错误率(CER)和速度"""
+    test_set = load_test_set(test_dir)
+    if not test_set:
+        print(f"测试集为空: {test_dir}")
+        return []
+    
+    total_audio_seconds = sum(len(audio) / 32000 for _, audio, _ in test_set)
+    total_ref_chars = sum(len(ref) for _, _, ref in test_set)
+    print(f"测试集: {len(test_set)}个文件, 共{total_audio_seconds:.1f}秒音频")
+    
+    results = []
+    for backend in backends:
+        print(f"正在测试后端: {backend}")
+        try:
+            results.append(benchmark_backend(test_set, model_name, backend, total_audio_seconds, total_ref_chars))
+        except Exception as e:
+            # 某个后端不可用（如未安装funasr-onnx或导出失败）时记录失败，继续测试其他后端
+            print(f"后端测试失败 {backend}: {e}")
+            results.append({'backend': backend, 'error': str(e)})
+    
+    print(f"\n{'后端':<12}{'CER':>8}{'RTF':>8}{'平均延迟':>10}{'P95延迟':>10}{'加载耗时':>10}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['backend']:<12}失败: {r['error']}")
+            continue
+        print(f"{r['backend']:<12}{r['cer']:>8.2%}{r['rtf']:>8.3f}{r['avg_latency']:>9.3f}s{r['p95_latency']:>9.3f}s{r['load_seconds']:>9.1f}s")
+    
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"详细结果已保存: {output_file}")
+    return results
+
+def collect_batch_files(source):
+    """
+    收集待批量识别的WAV文件
+    source 为目录时递归查找，为文件时作为清单读取（每行一个路径，相对路径以清单所在目录为基准）
+    """
+    files = []
+    if os.path.isdir(source):
+        for root, dirs, filenames in os.walk(source):
+            dirs.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith('.wav'):
+                    files.append(os.path.join(root, filename))
+    else:
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, 'r', encoding='utf-8') as f:
+            for line in f:
+                path = line.strip()
+                if not path or path.startswith('#'):
+                    continue
+                if not os.path.isabs(path):
+                    path = os.path.join(base_dir, path)
+                files.append(path)
+    return files
+
+def batch_record_key(record):
+    """批量识别记录的去重键：同一文件由不同模型或后端识别的结果分别保留"""
+    return record['path'], record.get('model'), record.get('backend')
+
+def load_batch_checkpoint(checkpoint_file):
+    """
+    读取批量识别的断点文件，返回 {(路径, 模型, 后端): 记录}（仅包含识别成功的记录）
+    中断写入留下的残缺行、失败记录和重复记录会被清理并重写文件，保证之后追加的记录从新行开始
+    """
+    if not os.path.exists(checkpoint_file):
+        return {}
+    
+    records = {}
+    line_count = 0
+    with open(checkpoint_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line_count += 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'error' not in record:
+                records[batch_record_key(record)] = record
+    
+    with open(checkpoint_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        ends_with_newline = f.tell() == 0
+        if not ends_with_newline:
+            f.seek(-1, os.SEEK_END)
+            ends_with_newline = f.read(1) == b'\n'
+    
+    if len(records) != line_count or not ends_with_newline:
+        temp_file = checkpoint_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            for record in records.values():
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(temp_file, checkpoint_file)
+        print(f"断点文件已整理: 保留{len(records)}条成功记录，移除{line_count - len(records)}行")
+    return records
+
+def run_batch_transcription(source, output_file, workers=2, batch_size=8):
+    """
+    离线批量识别，不启动Flask服务
+    结果逐行追加写入JSONL（输出为 .parquet 时先写入 .partial.jsonl，完成后再转换），
+    重新运行时跳过当前模型和后端已成功识别的文件，实现断点续传；失败的文件会重新识别，其旧的失败记录在续传前移除
+    更换模型或后端后写入同一输出文件时，所有文件都会用新模型重新识别，新旧结果按 model/backend 字段区分
+    """
+    import queue
+    
+    write_parquet = output_file.lower().endswith('.parquet')
+    checkpoint_file = output_file + '.partial.jsonl' if write_parquet else output_file
+    
+    alias, asr_model = model_manager.resolve()
+    entry = model_manager.models[alias]
+    model_name = entry['model_name']
+    backend = entry['backend']
+    
+    # 读取当前模型和后端已完成的文件
+    done = {path for path, model, record_backend in load_batch_checkpoint(checkpoint_file)
+            if model == model_name and record_backend == backend}
+    
+    pending = [path for path in collect_batch_files(source) if os.path.abspath(path) not in done]
+    total = len(pending)
+    print(f"待识别文件: {total}个（模型 {model_name} [{backend}] 已完成{len(done)}个）")
+    
+    batches = queue.Queue(maxsize=workers * 2)
+    output_lock = threading.Lock()
+    progress = {'files': 0, 'failures': 0, 'audio_seconds': 0.0}
+    
+    def write_records(records):
+        with output_lock:
+            for record in records:
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                progress['files'] += 1
+                if 'error' in record:
+                    progress['failures'] += 1
+                else:
+                    progress['audio_seconds'] += record['duration']
+            out.flush()
+    
+    def worker():
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            records = []
+            audio_list = []
+            loaded = []
+            for path in batch:
+                record = {
+                    'path': os.path.abspath(path),
+                    'student': os.path.basename(os.path.dirname(path)),
+                    'filename': os.path.basename(path),
+                    'model': model_name,
+                    'backend': backend
+                }
+                audio_data = load_wav_file(path)
+                if audio_data is None:
+                    record['error'] = '无法读取WAV文件'
+                    records.append(record)
+                else:
+                    record['duration'] = round(len(audio_data) / 32000, 2)
+                    audio_list.append(audio_data)
+                    loaded.append(record)
+            
+            if audio_list:
+                try:
+                    segments_list = decode_audio_batch(asr_model, audio_list, batch_size=batch_size)
+                    for record, segments in zip(loaded, segments_list):
+                        record['text'] = ''.join(segment['text'] for segment in segments)
+                        record['segments'] = segments
+                except Exception as e:
+                    print(f"批量识别失败: {e}")
+                    for record in loaded:
+                        record['error'] = str(e)
+                records.extend(loaded)
+            write_records(records)
+    
+    start = time.time()
+    with open(checkpoint_file, 'a', encoding='utf-8') as out:
+        threads = [threading.Thread(target=worker, name=f'batch-worker-{i}', daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        
+        last_report = start
+        for i in range(0, total, batch_size):
+            # 队列有界，文件按需流式读取；等待期间定期报告进度
+            while True:
+                try:
+                    batches.put(pending[i:i + batch_size], timeout=1)
+                    break
+                except queue.Full:
+                    pass
+                if time.time() - last_report >= 10:
+                    last_report = time.time()
+                    report_batch_progress(progress, total, start)
+        for _ in threads:
+            batches.put(None)
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=10)
+            report_batch_progress(progress, total, start)
+    
+    elapsed = time.time() - start
+    print(f"批量识别完成: {progress['files']}个文件, 失败{progress['failures']}个, "
+          f"耗时{elapsed:.1f}秒, 音频{progress['audio_seconds']:.1f}秒")
+    
+    if write_parquet:
+        import pandas as pd
+        records = {}
+        with open(checkpoint_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[batch_record_key(record)] = record
+        df = pd.DataFrame(list(records.values()))
+        if 'segments' in df.columns:
+            df['segments'] = df['segments'].apply(lambda x: json.dumps(x, ensure_ascii=False) if isinstance(x, list) else None)
+        df.to_parquet(output_file, index=False)
+        print(f"结果已保存: {output_file}")
+
+def report_batch_progress(progress, total, start):
+    """打印批量识别的吞吐量和预计剩余时间"""
+    elapsed = time.time() - start
+    done = progress['files']
+    rate = done / elapsed if elapsed > 0 else 0
+    eta = (total - done) / rate if rate > 0 else 0
+    print(f"进度: {done}/{total}, {rate:.2f}文件/秒, "
+          f"音频{progress['audio_seconds'] / elapsed if elapsed > 0 else 0:.1f}秒/秒, 预计剩余{eta:.0f}秒")
 
 # 监控线程相关变量
 monitoring_thread = None
 monitoring_active = False
+monitoring_started_at = 0
 processed_files = set()
+pending_files = set()  # 已提交识别但尚未完成的文件
+monitored_files = {}  # 监控发现但尚未识别完成的文件 -> {'class': 任务类别, 'rejected': 是否已因队列满被拒绝}
+
+def process_monitored_file(filepath, filename, student_name):
+    """识别监控到的文件并记录结果（在识别工作线程中执行）"""
+    global recognized_messages
+    try:
+        # 进行语音识别
+        result_text = recognize_wav_file(filepath, student_name=student_name)
+        if result_text is not None:
+            # 添加到消息列表
+            with recognized_messages_lock:
+                recognized_messages.append({
+                    'student': student_name,
+                    'text': result_text,
+                    'timestamp': time.time(),
+                    'filename': filename
+                })
+                # 保持最多100条消息
+                if len(recognized_messages) > 100:
+                    recognized_messages = recognized_messages[-100:]
+            
+            print(f"自动识别完成: {student_name} - {filename}")
+        
+    except Exception as e:
+        print(f"自动处理文件失败 {filepath}: {e}")
+        # 添加错误消息到识别结果
+        with recognized_messages_lock:
+            recognized_messages.append({
+                'student': student_name,
+                'text': f"[识别失败: {str(e)}]",
+                'timestamp': time.time(),
+                'filename': filename
+            })
+            # 保持最多100条消息
+            if len(recognized_messages) > 100:
+                recognized_messages = recognized_messages[-100:]
+    finally:
+        # 标记为已处理（失败的文件也不再重复尝试）
+        processed_files.add(filepath)
+        pending_files.discard(filepath)
+        monitored_files.pop(filepath, None)
 
 def monitor_student_folders():
     """监控学生文件夹中的新WAV文件"""
@@ -703,64 +1998,52 @@ def monitor_student_folders():
                             all_student_folders.append(item)
             
             # 监控所有学生文件夹
+            new_files = []
             for student_name in all_student_folders:
                 student_folder = os.path.join(UPLOAD_FOLDER, student_name)
                 if not os.path.exists(student_folder):
                     continue
                 
-                # 获取文件夹中所有WAV文件
-                wav_files = []
+                # 获取文件夹中所有未处理的WAV文件
                 try:
                     for filename in os.listdir(student_folder):
                         if filename.lower().endswith('.wav'):
                             filepath = os.path.join(student_folder, filename)
-                            wav_files.append((filepath, filename, os.path.getmtime(filepath)))
+                            if filepath not in processed_files and filepath not in pending_files:
+                                new_files.append((filepath, filename, student_name, os.path.getmtime(filepath)))
                 except Exception as e:
                     print(f"读取文件夹失败 {student_folder}: {e}")
                     continue
-                
-                # 按修改时间排序，最新的在前面
-                wav_files.sort(key=lambda x: x[2], reverse=True)
-                
-                # 处理所有未处理的文件
-                for filepath, filename, mtime in wav_files:
-                    file_key = filepath  # 使用完整文件路径作为唯一标识
-                    if file_key not in processed_files:
-                        try:
-                            # 进行语音识别
-                            result_text = recognize_wav_file(filepath)
-                            if result_text is not None:
-                                # 添加到消息列表
-                                with recognized_messages_lock:
-                                    recognized_messages.append({
-                                        'student': student_name,
-                                        'text': result_text,
-                                        'timestamp': time.time(),
-                                        'filename': filename
-                                    })
-                                    # 保持最多100条消息
-                                    if len(recognized_messages) > 100:
-                                        recognized_messages = recognized_messages[-100:]
-                                
-                                print(f"自动识别完成: {student_name} - {filename}")
-                            
-                            # 标记为已处理
-                            processed_files.add(file_key)
-                            
-                        except Exception as e:
-                            print(f"自动处理文件失败 {filepath}: {e}")
-                            # 添加错误消息到识别结果
-                            with recognized_messages_lock:
-                                recognized_messages.append({
-                                    'student': student_name,
-                                    'text': f"[识别失败: {str(e)}]",
-                                    'timestamp': time.time(),
-                                    'filename': filename
-                                })
-                                # 保持最多100条消息
-                                if len(recognized_messages) > 100:
-                                    recognized_messages = recognized_messages[-100:]
-                            processed_files.add(file_key)  # 避免重复尝试失败的文件
+            
+            # 按修改时间排序，最新的在前面
+            new_files.sort(key=lambda x: x[3], reverse=True)
+            
+            # 文件在首次发现时确定类别并记录：运行期间新放入的少量文件按手动(manual)优先级识别，
+            # 启动前遗留的文件或单次扫描中超出数量限制的批量复制文件按补识别(backfill)处理
+            first_seen = 0
+            for filepath, filename, student_name, mtime in new_files:
+                if filepath in monitored_files:
+                    continue
+                if mtime >= monitoring_started_at and first_seen < MANUAL_BURST_LIMIT:
+                    job_class = 'manual'
+                else:
+                    job_class = 'backfill'
+                monitored_files[filepath] = {'class': job_class, 'rejected': False}
+                first_seen += 1
+            
+            # 队列已满的文件留待下次扫描再提交，重复提交不再计入拒绝数
+            for filepath, filename, student_name, mtime in new_files:
+                info = monitored_files[filepath]
+                pending_files.add(filepath)
+                future = scheduler.submit(info['class'], process_monitored_file, filepath, filename, student_name,
+                                          count_rejection=not info['rejected'])
+                if future is None:
+                    info['rejected'] = True
+                    pending_files.discard(filepath)
+                else:
+                    # 任务被取消或丢弃时允许下次扫描重新提交
+                    future.add_done_callback(
+                        lambda f, path=filepath: pending_files.discard(path) if f.cancelled() or f.exception() else None)
                 
             time.sleep(2)  # 每2秒检查一次
             
@@ -783,12 +2066,13 @@ def monitor_student_folders():
 
 def start_monitoring():
     """启动监控线程"""
-    global monitoring_thread, monitoring_active
+    global monitoring_thread, monitoring_active, monitoring_started_at
     if monitoring_active:
         return
     
     monitoring_active = True
-    monitoring_thread = threading.Thread(target=monitor_student_folders, daemon=True)
+    monitoring_started_at = time.time()
+    monitoring_thread = threading.Thread(target=monitor_student_folders, name='monitor', daemon=True)
     monitoring_thread.start()
     print("开始监控学生文件夹...")
 
@@ -807,10 +2091,51 @@ if __name__ == '__main__':
     parser.add_argument("--host", default="127.0.0.1", help="服务器主机地址 (默认: 127.0.0.1)")
     parser.add_argument("--port", type=int, default=5000, help="服务器端口 (默认: 5000)")
     parser.add_argument("--no-monitor", action="store_true", help="禁用文件监控功能")
+    parser.add_argument("--asr-workers", type=int, default=ASR_WORKERS, help=f"同时进行识别的任务数 (默认: {ASR_WORKERS})")
+    parser.add_argument("--admin-token", default=None, help="管理接口令牌 (默认读取环境变量 ASR_ADMIN_TOKEN)")
+    parser.add_argument("--tracemalloc", action="store_true", help="启动时开启tracemalloc内存分配跟踪")
+    parser.add_argument("--backend", choices=ASR_BACKENDS, default=DEFAULT_BACKEND, help="推理后端 (默认: torch，onnx-int8 为INT8量化的ONNX模型)")
+    parser.add_argument("--intra-op-threads", type=int, default=ONNX_INTRA_OP_THREADS, help=f"ONNX Runtime 算子内线程数 (默认: {ONNX_INTRA_OP_THREADS})")
+    parser.add_argument("--inter-op-threads", type=int, default=ONNX_INTER_OP_THREADS, help=f"ONNX Runtime 算子间线程数 (默认: {ONNX_INTER_OP_THREADS})")
+    parser.add_argument("--benchmark", metavar="DIR", help="在测试集目录上对比各后端的准确率和速度后退出（WAV文件需有同名.txt参考文本）")
+    parser.add_argument("--benchmark-backends", default=",".join(ASR_BACKENDS), help="参与对比的后端，逗号分隔 (默认: 全部)")
+    parser.add_argument("--benchmark-output", help="对比结果JSON保存路径")
+    parser.add_argument("--batch", metavar="PATH", help="离线批量识别目录（如uploads/）或清单文件中的WAV后退出，不启动服务")
+    parser.add_argument("--batch-output", default="transcripts.jsonl", help="批量识别结果文件，.jsonl 或 .parquet (默认: transcripts.jsonl)")
+    parser.add_argument("--batch-workers", type=int, default=2, help="批量识别工作线程数 (默认: 2)")
+    parser.add_argument("--batch-size", type=int, default=8, help="批量识别每批文件数，同时作为模型推理的批大小 (默认: 8)")
     args = parser.parse_args()
     
+    DEFAULT_BACKEND = args.backend
+    ONNX_INTRA_OP_THREADS = args.intra_op_threads
+    ONNX_INTER_OP_THREADS = args.inter_op_threads
+    
+    if args.benchmark:
+        backends = [b.strip() for b in args.benchmark_backends.split(',') if b.strip()]
+        for backend in backends:
+            if backend not in ASR_BACKENDS:
+                parser.error(f"不支持的推理后端: {backend}")
+        run_backend_benchmark(args.benchmark, args.model, backends, args.benchmark_output)
+        sys.exit(0)
+    
+    if args.batch:
+        model_manager.load('default', args.model, backend=args.backend, make_default=True)
+        run_batch_transcription(args.batch, args.batch_output, workers=args.batch_workers, batch_size=args.batch_size)
+        sys.exit(0)
+    
+    if args.admin_token is not None:
+        ADMIN_TOKEN = args.admin_token
+    
+    if args.tracemalloc:
+        import tracemalloc
+        tracemalloc.start(25)
+        print("已开启tracemalloc内存跟踪")
+    
     # 初始化模型
-    init_model(args.model)
+    init_model(args.model, args.backend)
+    
+    # 启动识别调度器
+    scheduler.start(args.asr_workers)
     
     # 启动监控（默认启用，除非指定 --no-monitor）
     if not args.no_monitor:
@@ -822,4 +2147,5 @@ if __name__ == '__main__':
         app.run(host=args.host, port=args.port, debug=False)
     finally:
         if not args.no_monitor:
-            stop_monitoring()
\ No newline at end of file
+            stop_monitoring()
+        scheduler.stop()
\ No newline at end of file